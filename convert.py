@@ -1,27 +1,49 @@
 import os
+import shutil
 import subprocess
 from pathlib import Path
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import functools
 import logging
 import sys
 
+# Use orjson to load the metadata file when it's installed; it parses much faster
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=1)
 def check_ffmpeg():
     """Check if ffmpeg is installed and accessible"""
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+    if shutil.which('ffmpeg') is not None:
         return True
+    logger.error("ffmpeg is not installed or not accessible in your system PATH.")
+    logger.error("Please install ffmpeg to use this script:")
+    logger.error("- macOS: brew install ffmpeg")
+    logger.error("- Ubuntu/Debian: sudo apt-get install ffmpeg")
+    logger.error("- Windows: Download from https://ffmpeg.org/download.html")
+    return False
+
+def get_ffmpeg_version():
+    """
+    Get the ffmpeg version banner
+    Returns the first line of `ffmpeg -version`, or None if it can't be run
+    """
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()[0] if result.stdout else None
     except (subprocess.CalledProcessError, FileNotFoundError):
-        logger.error("ffmpeg is not installed or not accessible in your system PATH.")
-        logger.error("Please install ffmpeg to use this script:")
-        logger.error("- macOS: brew install ffmpeg")
-        logger.error("- Ubuntu/Debian: sudo apt-get install ffmpeg")
-        logger.error("- Windows: Download from https://ffmpeg.org/download.html")
-        return False
+        return None
 
-# Default directory path for audio files
+# Default directory path for audio files, used when neither --audio-dir nor
+# the AUDIO_DIR environment variable is set
 AUDIO_DIR = '/path/to/your/audio/directory'  # Change this line to your specific path
 
 # CDJ Compatibility Requirements
@@ -58,9 +80,10 @@ CDJ_REQUIREMENTS = {
     }
 }
 
-def get_conversion_params(metadata):
+def get_conversion_params(metadata, threads=1):
     """
     Determine the conversion parameters needed for CDJ compatibility
+    `threads` caps the number of threads ffmpeg may use for this conversion
     Returns a tuple of (output_format, ffmpeg_params)
     """
     file_type = metadata['file_type'].lstrip('.')
@@ -117,31 +140,73 @@ def get_conversion_params(metadata):
     if metadata['channels'] != 2:
         params.extend(['-ac', '2'])
     
+    # Limit ffmpeg's own threading so parallel jobs don't oversubscribe the CPU;
+    # libmp3lame is single-threaded, so extra threads would only sit idle
+    if target_format == 'mp3':
+        threads = 1
+    params[:0] = ['-threads', str(threads)]
+    
     return target_format, params
 
-def convert_file(input_path, output_path, ffmpeg_params):
+def convert_file(input_path, outputs):
     """
     Convert an audio file using ffmpeg
+    `outputs` is a list of (ffmpeg_params, output_path) tuples, all produced
+    from a single decode of the input
     Returns True if successful, False otherwise
     """
+    # Write to temporary files first so an interrupted run never leaves a
+    # partial file that a later run would mistake for a finished conversion;
+    # the pid keeps concurrent conversions from sharing a temporary file
+    partial_paths = [output_path.with_name(f"{output_path.stem}.part{os.getpid()}{output_path.suffix}")
+                     for _, output_path in outputs]
     try:
-        cmd = ['ffmpeg', '-i', str(input_path), '-y'] + ffmpeg_params + [str(output_path)]
-        logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', str(input_path), '-y']
+        for (ffmpeg_params, _), partial_path in zip(outputs, partial_paths):
+            cmd += ffmpeg_params + [str(partial_path)]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Running ffmpeg command: %s", ' '.join(cmd))
+        # Keep only the tail of ffmpeg's log; it's only needed if the conversion fails
+        with subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as proc:
+            stderr_tail = deque(proc.stderr, maxlen=64)
+            returncode = proc.wait()
         
-        if result.returncode == 0:
-            logger.info(f"Successfully converted: {input_path.name}")
+        if returncode == 0:
+            for (_, output_path), partial_path in zip(outputs, partial_paths):
+                os.replace(partial_path, output_path)
+            logger.debug("Successfully converted: %s", input_path.name)
             return True
         else:
-            logger.error(f"Error converting {input_path.name}: {result.stderr}")
+            stderr = b''.join(stderr_tail).decode(errors='replace')
+            logger.error(f"Error converting {input_path.name}: {stderr}")
             return False
     except Exception as e:
         logger.error(f"Error converting {input_path.name}: {str(e)}")
         return False
+    finally:
+        for partial_path in partial_paths:
+            partial_path.unlink(missing_ok=True)
 
-def process_directory(directory_path):
+def _init_worker(level):
+    """
+    Apply the parent's log level to this module's logger in a worker process
+    """
+    logger.setLevel(level)
+
+def _convert_worker(task):
+    """
+    Unpack a conversion task and run it in a worker process
+    Returns a tuple of (input_path, outputs, success)
+    """
+    input_path, outputs = task
+    return input_path, outputs, convert_file(input_path, outputs)
+
+def process_directory(directory_path, jobs=None, force=False, metadata_file='audio_metadata_report.json'):
     """
     Process all audio files in the directory and convert incompatible ones
+    Metadata is read from `metadata_file` as written by scan.py
+    Conversions run in parallel across `jobs` processes (defaults to the CPU count)
+    Files already converted since their source last changed are skipped unless `force` is set
     """
     if not check_ffmpeg():
         return
@@ -151,55 +216,14 @@ def process_directory(directory_path):
     converted_dir.mkdir(exist_ok=True)
     logger.info(f"Created/verified converted directory at: {converted_dir}")
     
-    # Load metadata from the report
+    # Load metadata written by scan.py
     try:
-        with open('audio_metadata_report.txt', 'r') as f:
-            report_content = f.read()
+        with open(metadata_file, 'rb') as f:
+            audio_files = json_loads(f.read())
     except FileNotFoundError:
-        logger.error("audio_metadata_report.txt not found. Please run scan.py first.")
+        logger.error(f"{metadata_file} not found. Please run scan.py first.")
         return
     
-    # Process each file
-    audio_files = []
-    current_file = None
-    current_metadata = {}
-    
-    for line in report_content.split('\n'):
-        if line.startswith('File: '):
-            if current_metadata:
-                audio_files.append(current_metadata)
-            current_file = line[6:].strip()
-            current_metadata = {'filename': current_file}
-        elif line.startswith('  Type: '):
-            current_metadata['file_type'] = line[8:].strip()
-        elif line.startswith('  Sample Rate: '):
-            try:
-                current_metadata['sample_rate'] = int(line[14:].split()[0])
-            except (ValueError, IndexError):
-                current_metadata['sample_rate'] = None
-        elif line.startswith('  Bit Depth: '):
-            try:
-                value = line[12:].split()[0]
-                current_metadata['bit_depth'] = None if value == 'None' else int(value)
-            except (ValueError, IndexError):
-                current_metadata['bit_depth'] = None
-        elif line.startswith('  Channels: '):
-            try:
-                current_metadata['channels'] = int(line[11:].strip())
-            except (ValueError, IndexError):
-                current_metadata['channels'] = None
-        elif line.startswith('  Bitrate: '):
-            try:
-                value = line[10:].split()[0]
-                current_metadata['bitrate'] = None if value == 'None' else float(value)
-            except (ValueError, IndexError):
-                current_metadata['bitrate'] = None
-        elif line.startswith('  CDJ Compatible: '):
-            current_metadata['is_compatible'] = line[17:].strip() == 'Yes'
-    
-    if current_metadata:
-        audio_files.append(current_metadata)
-    
     # Process incompatible files
     incompatible_files = [f for f in audio_files if not f.get('is_compatible', True)]
     
@@ -209,41 +233,108 @@ def process_directory(directory_path):
     
     logger.info(f"Found {len(incompatible_files)} incompatible files to convert.")
     
+    # Share the CPU cores between the parallel ffmpeg processes
+    cpu_count = os.cpu_count() or 1
+    jobs = jobs or cpu_count
+    threads_per_job = max(1, cpu_count // jobs)
+    
+    # Work out every conversion first, so output names don't depend on metadata order
+    conversions = {}
     for metadata in incompatible_files:
         input_path = Path(directory_path) / metadata['filename']
         if not input_path.exists():
             logger.warning(f"File not found: {metadata['filename']}")
             continue
+        if input_path in conversions:
+            continue
         
         # Determine conversion parameters
-        target_format, ffmpeg_params = get_conversion_params(metadata)
-        
-        # Create output path
-        output_filename = input_path.stem + '.' + target_format
-        output_path = converted_dir / output_filename
+        conversions[input_path] = get_conversion_params(metadata, threads_per_job)
+    
+    # Inputs sharing a stem (e.g. song.wav and song.aif) would write the same
+    # converted file, so every input in such a group gets its source extension in the name
+    stem_counts = Counter((input_path.stem, target_format)
+                          for input_path, (target_format, _) in conversions.items())
+    output_paths = {}
+    for input_path, (target_format, _) in conversions.items():
+        if stem_counts[input_path.stem, target_format] > 1:
+            output_filename = f"{input_path.stem}_{input_path.suffix.lstrip('.')}.{target_format}"
+        else:
+            output_filename = f"{input_path.stem}.{target_format}"
+        output_paths[input_path] = converted_dir / output_filename
+    
+    # A disambiguated name can still match another input's plain name; convert neither
+    path_counts = Counter(output_paths.values())
+    
+    # Group outputs by input file so each input is decoded only once
+    tasks = {}
+    for input_path, (_, ffmpeg_params) in conversions.items():
+        output_path = output_paths[input_path]
+        if path_counts[output_path] > 1:
+            logger.warning(f"Skipping {input_path.name}: {output_path.name} would also be written by another file")
+            continue
         
-        logger.info(f"Converting {input_path} to {output_path}")
+        # Skip files converted by a previous run
+        if (not force and output_path.exists()
+                and output_path.stat().st_mtime >= input_path.stat().st_mtime):
+            logger.info(f"Skipping (up to date): {output_path.name}")
+            continue
         
-        # Convert file
-        if convert_file(input_path, output_path, ffmpeg_params):
-            logger.info(f"Successfully converted {metadata['filename']} to {output_filename}")
-            # Verify the file was created
-            if output_path.exists():
-                logger.info(f"Verified converted file exists at: {output_path}")
-            else:
-                logger.error(f"Converted file not found at: {output_path}")
-        else:
-            logger.error(f"Failed to convert {metadata['filename']}")
+        logger.debug("Converting %s to %s", input_path, output_path)
+        tasks.setdefault(input_path, []).append((ffmpeg_params, output_path))
+    
+    # Convert files in parallel; workers inherit the current log level
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_worker, initargs=(logger.level,)) as executor:
+        for input_path, outputs, success in executor.map(_convert_worker, tasks.items()):
+            if not success:
+                logger.error(f"Failed to convert {input_path.name}")
+                continue
+            for _, output_path in outputs:
+                logger.info(f"Successfully converted {input_path.name} to {output_path.name}")
+                # Verify the file was created
+                if output_path.exists():
+                    logger.debug("Verified converted file exists at: %s", output_path)
+                else:
+                    logger.error(f"Converted file not found at: {output_path}")
+
+def positive_int(value):
+    """Argparse type for options that must be a positive integer"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid positive integer: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 def main():
-    # Check if the default directory exists
-    if not os.path.exists(AUDIO_DIR):
-        logger.error(f"Error: Directory '{AUDIO_DIR}' does not exist.")
-        logger.error("Please update the AUDIO_DIR variable in convert.py with your audio directory path.")
+    parser = argparse.ArgumentParser(description="Convert incompatible audio files to CDJ-compatible formats")
+    parser.add_argument('--audio-dir', default=os.environ.get('AUDIO_DIR', AUDIO_DIR),
+                        help="Directory containing the audio files (default: $AUDIO_DIR)")
+    parser.add_argument('--metadata-json', default='audio_metadata_report.json',
+                        help="Metadata file written by scan.py (default: audio_metadata_report.json)")
+    parser.add_argument('--jobs', type=positive_int, default=None,
+                        help="Number of parallel ffmpeg conversions (default: CPU count)")
+    parser.add_argument('--force', action='store_true',
+                        help="Reconvert files even if an up-to-date converted copy exists")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Enable debug logging and report the ffmpeg version")
+    args = parser.parse_args()
+    
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    
+    # Check if the audio directory exists
+    if not os.path.exists(args.audio_dir):
+        logger.error(f"Error: Directory '{args.audio_dir}' does not exist.")
+        logger.error("Please pass --audio-dir or set the AUDIO_DIR environment variable to your audio directory path.")
         return
     
-    logger.info(f"Processing directory: {AUDIO_DIR}")
-    process_directory(AUDIO_DIR)
+    logger.info(f"Processing directory: {args.audio_dir}")
+    if args.verbose and check_ffmpeg():
+        logger.debug(f"Using {get_ffmpeg_version()}")
+    process_directory(args.audio_dir, jobs=args.jobs, force=args.force, metadata_file=args.metadata_json)
     logger.info("Conversion process completed.")
 
 if __name__ == "__main__":
@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
 import os
+import io
+import json
+import argparse
 from pathlib import Path
 from mutagen import File as MutagenFile
 from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
-from mutagen.wave import WAVE
-from mutagen.flac import FLAC
-from mutagen.aiff import AIFF
-from mutagen.mp4 import MP4
-from mutagen.oggvorbis import OggVorbis
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 
@@ -17,9 +15,16 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
-# Default directory path for audio files
+# Number of threads used to read file metadata in parallel
+SCAN_WORKERS = 32
+
+# Default directory path for audio files, used when neither --audio-dir nor
+# the AUDIO_DIR environment variable is set
 AUDIO_DIR = '/path/to/your/audio/directory'  # Change this line to your specific path
 
+# File extensions picked up by the scan
+AUDIO_EXTS = frozenset({'.mp3', '.wav', '.wave', '.flac', '.aif', '.aiff', '.m4a', '.ogg'})
+
 # CDJ Compatibility Requirements
 CDJ_REQUIREMENTS = {
     'wav': {
@@ -54,93 +59,99 @@ CDJ_REQUIREMENTS = {
     }
 }
 
+def _make_checker(reqs):
+    """
+    Build a compatibility check function for one format's requirements
+    Membership sets and bitrate bounds are resolved once, up front
+    """
+    sample_rates = frozenset(reqs['sample_rates'] or ())
+    bit_depths = frozenset(reqs['bit_depths'] or ())
+    channels = frozenset(reqs['channels'] or ())
+    min_bitrate, max_bitrate = reqs['bitrate'] or (None, None)
+
+    # Requirement lists as shown in issue messages
+    sample_rates_msg = reqs['sample_rates']
+    bit_depths_msg = reqs['bit_depths']
+    channels_msg = reqs['channels']
+
+    def checker(metadata):
+        issues = []
+
+        # Check sample rate
+        if sample_rates and metadata['sample_rate'] not in sample_rates:
+            issues.append(f"Sample rate {metadata['sample_rate']} Hz not supported. Required: {sample_rates_msg} Hz")
+
+        # Check bit depth
+        if bit_depths and metadata['bit_depth'] not in bit_depths:
+            issues.append(f"Bit depth {metadata['bit_depth']} bits not supported. Required: {bit_depths_msg} bits")
+
+        # Check channels
+        if channels and metadata['channels'] not in channels:
+            issues.append(f"Channel configuration not supported. Required: {channels_msg} channels")
+
+        # Check bitrate for lossy formats
+        bitrate = metadata['bitrate']
+        if bitrate:
+            if min_bitrate and bitrate < min_bitrate:
+                issues.append(f"Bitrate {bitrate} kbps too low. Minimum required: {min_bitrate} kbps")
+            if max_bitrate and bitrate > max_bitrate:
+                issues.append(f"Bitrate {bitrate} kbps too high. Maximum allowed: {max_bitrate} kbps")
+
+        return len(issues) == 0, issues
+
+    return checker
+
+# Precompiled compatibility checks, keyed by format
+_CHECKERS = {fmt: _make_checker(reqs) for fmt, reqs in CDJ_REQUIREMENTS.items()}
+
 def check_compatibility(metadata):
     """
     Check if a file meets CDJ compatibility requirements
     Returns a tuple of (is_compatible, issues)
     """
-    issues = []
-    file_type = metadata['file_type'].lstrip('.')
-    
-    if file_type not in CDJ_REQUIREMENTS:
+    checker = _CHECKERS.get(metadata['file_type'].lstrip('.'))
+    if checker is None:
         return False, ["Format not supported by CDJs"]
-    
-    reqs = CDJ_REQUIREMENTS[file_type]
-    
-    # Check sample rate
-    if reqs['sample_rates'] and metadata['sample_rate'] not in reqs['sample_rates']:
-        issues.append(f"Sample rate {metadata['sample_rate']} Hz not supported. Required: {reqs['sample_rates']} Hz")
-    
-    # Check bit depth
-    if reqs['bit_depths'] and metadata['bit_depth'] not in reqs['bit_depths']:
-        issues.append(f"Bit depth {metadata['bit_depth']} bits not supported. Required: {reqs['bit_depths']} bits")
-    
-    # Check channels
-    if reqs['channels'] and metadata['channels'] not in reqs['channels']:
-        issues.append(f"Channel configuration not supported. Required: {reqs['channels']} channels")
-    
-    # Check bitrate for lossy formats
-    if reqs['bitrate']:
-        min_bitrate, max_bitrate = reqs['bitrate']
-        if metadata['bitrate']:
-            if min_bitrate and metadata['bitrate'] < min_bitrate:
-                issues.append(f"Bitrate {metadata['bitrate']} kbps too low. Minimum required: {min_bitrate} kbps")
-            if max_bitrate and metadata['bitrate'] > max_bitrate:
-                issues.append(f"Bitrate {metadata['bitrate']} kbps too high. Maximum allowed: {max_bitrate} kbps")
-    
-    return len(issues) == 0, issues
+    return checker(metadata)
+
+# Report format name and whether a bitrate applies, keyed by file extension
+FORMAT_INFO = {
+    '.mp3': ('MP3', True),
+    '.wav': ('WAV', False),  # WAV doesn't have bitrate
+    '.wave': ('WAV', False),
+    '.flac': ('FLAC', False),  # FLAC is lossless
+    '.aif': ('AIFF', False),  # AIFF doesn't have bitrate
+    '.aiff': ('AIFF', False),
+    '.m4a': ('M4A', True),
+    '.ogg': ('OGG', True)
+}
 
 def get_format_specific_info(audio, file_type):
     """
     Extract format-specific metadata from audio file
     """
-    try:
-        if file_type == '.mp3':
-            if isinstance(audio, MP3):
-                return {
-                    'bitrate': round(audio.info.bitrate / 1000, 2) if hasattr(audio.info, 'bitrate') else None,
-                    'format': 'MP3'
-                }
-        elif file_type in ['.wav', '.wave']:
-            if isinstance(audio, WAVE):
-                return {
-                    'bitrate': None,  # WAV doesn't have bitrate
-                    'format': 'WAV'
-                }
-        elif file_type == '.flac':
-            if isinstance(audio, FLAC):
-                return {
-                    'bitrate': None,  # FLAC is lossless
-                    'format': 'FLAC'
-                }
-        elif file_type in ['.aif', '.aiff']:
-            if isinstance(audio, AIFF):
-                return {
-                    'bitrate': None,  # AIFF doesn't have bitrate
-                    'format': 'AIFF'
-                }
-        elif file_type == '.m4a':
-            if isinstance(audio, MP4):
-                return {
-                    'bitrate': round(audio.info.bitrate / 1000, 2) if hasattr(audio.info, 'bitrate') else None,
-                    'format': 'M4A'
-                }
-        elif file_type == '.ogg':
-            if isinstance(audio, OggVorbis):
-                return {
-                    'bitrate': round(audio.info.bitrate / 1000, 2) if hasattr(audio.info, 'bitrate') else None,
-                    'format': 'OGG'
-                }
-    except Exception as e:
-        logger.warning(f"Error getting format-specific info: {str(e)}")
-    return {'bitrate': None, 'format': None}
+    format_name, has_bitrate = FORMAT_INFO.get(file_type, (None, False))
+    bitrate = None
+    if has_bitrate:
+        try:
+            bitrate = getattr(audio.info, 'bitrate', None)
+            if bitrate is not None:
+                bitrate = round(bitrate / 1000, 2)
+        except Exception as e:
+            logger.warning(f"Error getting format-specific info: {str(e)}")
+            return {'bitrate': None, 'format': None}
+    return {'bitrate': bitrate, 'format': format_name}
 
-def get_audio_metadata(file_path):
+def get_audio_metadata(file_path, st=None):
     """
     Extract technical metadata from an audio file
+    `st` is an optional os.stat_result for the file; it is looked up here when omitted
     Returns a dictionary with relevant metadata for DJ equipment compatibility
     """
     try:
+        if st is None:
+            st = file_path.stat()
+
         # Try to load the file with mutagen
         audio = MutagenFile(file_path)
         if audio is None:
@@ -153,7 +164,7 @@ def get_audio_metadata(file_path):
         metadata = {
             'filename': file_path.name,
             'file_type': file_type,
-            'file_size_mb': round(os.path.getsize(file_path) / (1024 * 1024), 2),
+            'file_size_mb': round(st.st_size / (1024 * 1024), 2),
             'sample_rate': None,
             'bit_depth': None,
             'channels': None,
@@ -162,26 +173,75 @@ def get_audio_metadata(file_path):
         }
 
         # Extract basic audio properties
-        if hasattr(audio, 'info'):
-            if hasattr(audio.info, 'sample_rate'):
-                metadata['sample_rate'] = audio.info.sample_rate
-            if hasattr(audio.info, 'bits_per_sample'):
-                metadata['bit_depth'] = audio.info.bits_per_sample
-            elif hasattr(audio.info, 'bitdepth'):  # Some formats use different attribute names
-                metadata['bit_depth'] = audio.info.bitdepth
-            if hasattr(audio.info, 'channels'):
-                metadata['channels'] = audio.info.channels
-            elif hasattr(audio.info, 'nchannels'):  # Some formats use different attribute names
-                metadata['channels'] = audio.info.nchannels
+        info = getattr(audio, 'info', None)
+        if info is not None:
+            metadata['sample_rate'] = getattr(info, 'sample_rate', None)
+            # Some formats use different attribute names
+            metadata['bit_depth'] = getattr(info, 'bits_per_sample', None) or getattr(info, 'bitdepth', None)
+            metadata['channels'] = getattr(info, 'channels', None) or getattr(info, 'nchannels', None)
 
         return metadata
     except Exception as e:
         logger.error(f"Error processing {file_path}: {str(e)}")
         return None
 
-def generate_report(directory_path):
+# Per-file block of the Detailed File Information section
+FILE_DETAIL_TEMPLATE = (
+    "File: {m[filename]}\n"
+    "  Type: {m[file_type]}\n"
+    "  Format: {format_name}\n"
+    "  Size: {m[file_size_mb]} MB\n"
+    "  Sample Rate: {m[sample_rate]} Hz\n"
+    "  Bit Depth: {m[bit_depth]} bits\n"
+    "  Channels: {m[channels]}\n"
+)
+
+def find_audio_files(directory_path, extensions=AUDIO_EXTS):
+    """
+    Walk the directory tree and yield os.DirEntry objects for files with a matching extension
+    Like os.walk, symlinks to directories are treated as directories but not descended into
+    """
+    pending = [directory_path]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                try:
+                    is_symlink = entry.is_symlink()
+                except OSError:
+                    is_symlink = False
+                if not is_symlink:
+                    subdirs.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in extensions:
+                yield entry
+        pending.extend(reversed(subdirs))
+
+def read_entry_metadata(entry):
+    """
+    Extract metadata for a directory entry, taking the file size from the entry's stat()
+    """
+    try:
+        st = entry.stat()
+    except OSError:
+        st = None
+    return get_audio_metadata(Path(entry.path), st)
+
+def generate_report(directory_path, workers=SCAN_WORKERS):
     """
     Generate a technical report of audio files in the directory
+    Metadata is read by `workers` threads, so that many file reads can be in flight at once
+    Returns a tuple of (report_text, audio_files)
     """
     audio_files = []
     format_stats = defaultdict(int)
@@ -192,11 +252,13 @@ def generate_report(directory_path):
     compatibility_stats = {'compatible': 0, 'incompatible': 0}
     
     # Scan directory for audio files
-    audio_extensions = {'.mp3', '.wav', '.wave', '.flac', '.aif', '.aiff', '.m4a', '.ogg'}
-    for file_path in Path(directory_path).rglob('*'):
-        if file_path.suffix.lower() in audio_extensions:
+    entries = list(find_audio_files(directory_path))
+
+    # Read metadata in parallel, aggregate stats in the main thread
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for entry, metadata in zip(entries, executor.map(read_entry_metadata, entries)):
+            file_path = entry.path
             try:
-                metadata = get_audio_metadata(file_path)
                 if metadata:
                     is_compatible, issues = check_compatibility(metadata)
                     metadata['is_compatible'] = is_compatible
@@ -216,82 +278,103 @@ def generate_report(directory_path):
                 error_files.append(f"{file_path} (Error: {str(e)})")
 
     # Generate report
-    report = []
-    report.append("=== Audio Files Technical Report ===\n")
-    report.append(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    report.append(f"Directory scanned: {directory_path}")
-    report.append(f"Total audio files found: {len(audio_files)}")
+    report = io.StringIO()
+    report.write("=== Audio Files Technical Report ===\n\n")
+    report.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    report.write(f"Directory scanned: {directory_path}\n")
+    report.write(f"Total audio files found: {len(audio_files)}\n")
     if error_files:
-        report.append(f"Files with errors: {len(error_files)}\n")
+        report.write(f"Files with errors: {len(error_files)}\n\n")
     else:
-        report.append("All files processed successfully.\n")
+        report.write("All files processed successfully.\n\n")
 
     # CDJ Compatibility Summary
-    report.append("=== CDJ Compatibility Summary ===\n")
-    report.append(f"Compatible files: {compatibility_stats['compatible']}")
-    report.append(f"Incompatible files: {compatibility_stats['incompatible']}")
-    report.append(f"Compatibility rate: {(compatibility_stats['compatible'] / len(audio_files) * 100):.1f}%\n")
+    report.write("=== CDJ Compatibility Summary ===\n\n")
+    report.write(f"Compatible files: {compatibility_stats['compatible']}\n")
+    report.write(f"Incompatible files: {compatibility_stats['incompatible']}\n")
+    report.write(f"Compatibility rate: {(compatibility_stats['compatible'] / len(audio_files) * 100):.1f}%\n\n")
 
     # Summary Statistics
-    report.append("=== Summary Statistics ===\n")
-    report.append("File Types:")
+    report.write("=== Summary Statistics ===\n\n")
+    report.write("File Types:\n")
     for fmt, count in format_stats.items():
-        report.append(f"  {fmt}: {count} files")
+        report.write(f"  {fmt}: {count} files\n")
     
-    report.append("\nSample Rates:")
+    report.write("\nSample Rates:\n")
     for rate, count in sample_rate_stats.items():
-        report.append(f"  {rate} Hz: {count} files")
+        report.write(f"  {rate} Hz: {count} files\n")
     
-    report.append("\nBit Depths:")
+    report.write("\nBit Depths:\n")
     for depth, count in bit_depth_stats.items():
-        report.append(f"  {depth} bits: {count} files")
+        report.write(f"  {depth} bits: {count} files\n")
     
-    report.append("\nChannel Configurations:")
+    report.write("\nChannel Configurations:\n")
     for channels, count in channel_stats.items():
-        report.append(f"  {channels} channels: {count} files")
+        report.write(f"  {channels} channels: {count} files\n")
 
     # Detailed File Information
-    report.append("\n=== Detailed File Information ===\n")
+    report.write("\n=== Detailed File Information ===\n\n")
     for metadata in audio_files:
-        report.append(f"File: {metadata['filename']}")
-        report.append(f"  Type: {metadata['file_type']}")
-        report.append(f"  Format: {metadata['format'] or 'N/A'}")
-        report.append(f"  Size: {metadata['file_size_mb']} MB")
-        report.append(f"  Sample Rate: {metadata['sample_rate']} Hz")
-        report.append(f"  Bit Depth: {metadata['bit_depth']} bits")
-        report.append(f"  Channels: {metadata['channels']}")
+        report.write(FILE_DETAIL_TEMPLATE.format(m=metadata, format_name=metadata['format'] or 'N/A'))
         if metadata['bitrate']:
-            report.append(f"  Bitrate: {metadata['bitrate']} kbps")
-        report.append(f"  CDJ Compatible: {'Yes' if metadata['is_compatible'] else 'No'}")
+            report.write(f"  Bitrate: {metadata['bitrate']} kbps\n")
+        report.write(f"  CDJ Compatible: {'Yes' if metadata['is_compatible'] else 'No'}\n")
         if metadata['compatibility_issues']:
-            report.append("  Compatibility Issues:")
+            report.write("  Compatibility Issues:\n")
             for issue in metadata['compatibility_issues']:
-                report.append(f"    - {issue}")
-        report.append("")
+                report.write(f"    - {issue}\n")
+        report.write("\n")
 
     # Error Report
     if error_files:
-        report.append("\n=== Files with Errors ===\n")
+        report.write("\n=== Files with Errors ===\n\n")
         for error_file in error_files:
-            report.append(f"- {error_file}")
+            report.write(f"- {error_file}\n")
+
+    return report.getvalue(), audio_files
 
-    return "\n".join(report)
+def positive_int(value):
+    """Argparse type for options that must be a positive integer"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid positive integer: '{value}'")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 def main():
-    # Check if the default directory exists
-    if not os.path.exists(AUDIO_DIR):
-        logger.error(f"Error: Directory '{AUDIO_DIR}' does not exist.")
-        logger.error("Please update the AUDIO_DIR variable in scan.py with your audio directory path.")
+    parser = argparse.ArgumentParser(description="Generate a CDJ compatibility report for a directory of audio files")
+    parser.add_argument('--audio-dir', default=os.environ.get('AUDIO_DIR', AUDIO_DIR),
+                        help="Directory to scan (default: $AUDIO_DIR)")
+    parser.add_argument('--output', default='audio_metadata_report.txt',
+                        help="Path of the text report (default: audio_metadata_report.txt)")
+    parser.add_argument('--output-json', default='audio_metadata_report.json',
+                        help="Path of the metadata file read by convert.py (default: audio_metadata_report.json)")
+    parser.add_argument('--workers', type=positive_int, default=SCAN_WORKERS,
+                        help=f"Number of files read in parallel; raise for high-latency storage such as a NAS (default: {SCAN_WORKERS})")
+    args = parser.parse_args()
+
+    # Check if the audio directory exists
+    if not os.path.exists(args.audio_dir):
+        logger.error(f"Error: Directory '{args.audio_dir}' does not exist.")
+        logger.error("Please pass --audio-dir or set the AUDIO_DIR environment variable to your audio directory path.")
         return
 
-    logger.info(f"Scanning directory: {AUDIO_DIR}")
-    report = generate_report(AUDIO_DIR)
+    logger.info(f"Scanning directory: {args.audio_dir}")
+    report, audio_files = generate_report(args.audio_dir, workers=args.workers)
     
-    output_file = 'audio_metadata_report.txt'
+    output_file = args.output
     with open(output_file, 'w') as f:
         f.write(report)
     
+    # Machine-readable metadata for convert.py
+    json_file = args.output_json
+    with open(json_file, 'w') as f:
+        json.dump(audio_files, f)
+    
     logger.info(f"Report generated successfully: {output_file}")
+    logger.info(f"Metadata written to: {json_file}")
 
 if __name__ == "__main__":
     main()